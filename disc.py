@@ -1,21 +1,50 @@
 import os
 import datetime
 import discord
-import youtube_dl
 import asyncio
+import concurrent.futures
+import concurrent.futures.process
 import math
 import itertools
 import random
+import time
+import collections
+import logging
+import logging.handlers
+import queue
+import threading
+import functools
+import atexit
+import re
+import multiprocessing
 
 from discord.ext import commands
 
+try:
+    import uvloop
+except ImportError:  # not available on windows
+    uvloop = None
+
 ORPHEUS_DISCORD_TOKEN = os.environ.get("ORPHEUS_DISCORD_TOKEN")
+ORPHEUS_LOG_LEVEL = os.environ.get("ORPHEUS_LOG_LEVEL", "INFO")
+
+logger = logging.getLogger("orpheus")
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that enqueues records as they are, leaving all formatting to the listener thread."""
+
+    def prepare(self, record):
+        # the stock prepare formats the record on the logging thread, i.e. the event loop
+        return record
 
 
 ytdl_format_options = {
-    "format": "bestaudio/best",
-    "outtmpl": "%(extractor)s-%(id)s-%(title)s.%(ext)s",
-    "restrictfilenames": True,
+    "format": "bestaudio[acodec=opus]/bestaudio/best",
+    "skip_download": True,
+    "extract_flat": False,
+    "youtube_include_dash_manifest": False,
+    "extractor_args": {"youtube": {"player_client": ["android"]}},
     "noplaylist": True,
     "nocheckcertificate": True,
     "ignoreerrors": False,
@@ -26,16 +55,158 @@ ytdl_format_options = {
     "source_address": "0.0.0.0",  # bind to ipv4 since ipv6 addresses cause issues sometimes
 }
 FFMPEG_OPTIONS = {
-    "before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5",
+    "before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 "
+    "-probesize 32 -analyzeduration 0 -fflags nobuffer",
     "options": "-vn",
 }
 
-ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
 EMBED_COLOR = 0xA84300
+EMBED_FIELD_LIMIT = 1024  # max characters in an embed field value
+YT_VIDEO_ID_RE = re.compile(
+    r"(?:youtube\.com/watch\?(?:[^#]*&)?v=|youtu\.be/)([A-Za-z0-9_-]{11})"
+)
+IDLE_TIMEOUT = 300  # seconds to wait for a new song before leaving voice
+ANNOUNCE_DELAY = 0.5  # seconds to collect songs queued together into one message
+MAX_QUEUE_SIZE = 100  # songs waiting to play per guild
+
+# per-process YoutubeDL instance, created by _init_extractor in each pool worker
+ytdl = None
+
+
+def _init_extractor():
+    global ytdl
+    # make sure yt-dlp is allowed to use its lazy extractors before it is imported
+    os.environ.pop("YTDLP_NO_LAZY_EXTRACTORS", None)
+    import yt_dlp
+
+    ytdl = yt_dlp.YoutubeDL(ytdl_format_options)
+
+
+def _extract(search: str, ie_key: str = None):
+    """Return the first entry found for search with only the fields Song needs, or None."""
+    try:
+        data = ytdl.extract_info(search, download=False, ie_key=ie_key)
+    except Exception as e:
+        # yt-dlp errors hold on to tracebacks, which can't be sent back from the worker
+        raise ValueError(str(e)) from None
+    if data is None:
+        return None
+    entries = data.get("entries")
+    if entries is not None:
+        data = next((entry for entry in entries if entry), None)
+        if data is None:
+            return None
+    # trimmed here so the formats, signed urls etc. never get pickled back to the bot
+    return {field: data.get(field) for field in (*ExtractCache.FIELDS, "is_live")}
+
+
+# started under __main__, so the spawned workers that import this module don't start their own
+EXTRACT_POOL = None
+
+
+def _start_extract_pool():
+    global EXTRACT_POOL
+    # spawned, not forked: forking the running bot would copy its threads' locks mid-use.
+    # bounded so a burst of !play commands can't start a worker per core
+    EXTRACT_POOL = concurrent.futures.ProcessPoolExecutor(
+        max_workers=min(4, os.cpu_count() or 1),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_extractor,
+    )
+
+
+def _stop_extract_pool():
+    EXTRACT_POOL.shutdown(wait=False, cancel_futures=True)
+
+
+# the event loop only keeps weak references to tasks, so hold on to running ones here
+_pending = set()
+
+
+def _create_task(coro):
+    task = asyncio.create_task(coro)
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+    return task
+
+
+def _log_task_error(task):
+    """Done-callback for fire-and-forget tasks, whose errors nobody else would see."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(
+            "%s failed", task.get_coro().__qualname__, exc_info=task.exception()
+        )
+
+
+def clean_yt_watch_url(url: str) -> str:
+    """Reduce a youtube video url to its video id, dropping timestamps, playlists and tracking params."""
+    if match := YT_VIDEO_ID_RE.search(url):
+        return f"https://www.youtube.com/watch?v={match.group(1)}"
+    return url
+
+
+class ExtractCache:
+    """LRU cache of song metadata by search string or video, with entries expiring after ttl seconds."""
+
+    # the only fields Song needs, so cached entries stay small
+    FIELDS = ("title", "url", "acodec", "webpage_url", "thumbnail", "duration")
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3 * 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl  # youtube stream urls expire after ~6 hours
+        self._entries = collections.OrderedDict()
+
+    @staticmethod
+    def key(search: str) -> str:
+        search = search.strip()
+        # urls are case sensitive, plain search strings aren't
+        if "/" in search:
+            return clean_yt_watch_url(search)
+        return search.lower()
+
+    def get(self, search: str):
+        key = self.key(search)
+        try:
+            timestamp, data = self._entries[key]
+        except KeyError:
+            return None
+        if time.monotonic() - timestamp >= self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return data
+
+    def put(self, search: str, data: dict) -> dict:
+        key = self.key(search)
+        data = {field: data.get(field) for field in self.FIELDS}
+        self._entries[key] = (time.monotonic(), data)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return data
+
+
+extract_cache = ExtractCache()
+
+
+@functools.lru_cache(maxsize=4096)
+def fmt_duration(duration_seconds: int):
+    minutes, seconds = divmod(duration_seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours:d}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:d}:{seconds:02d}"
 
 
 # class queue idea from a gist by vbe0201
-class SongQueue(asyncio.Queue):
+class SongQueue:
+    __slots__ = ("_queue", "_has_items")
+
+    def __init__(self):
+        self._queue = collections.deque()
+        # set exactly while the queue is non-empty
+        self._has_items = asyncio.Event()
+
     def __getitem__(self, item):
         if isinstance(item, slice):
             return list(itertools.islice(self._queue, item.start, item.stop, item.step))
@@ -46,96 +217,194 @@ class SongQueue(asyncio.Queue):
         return self._queue.__iter__()
 
     def __len__(self):
-        return self.qsize()
+        return len(self._queue)
+
+    def put(self, song):
+        self._queue.append(song)
+        self._has_items.set()
+
+    async def get(self):
+        """Wait for a song and take it off the front of the queue."""
+        # emptied by !clear or !remove between the put that woke us and now, so wait again
+        while not self._queue:
+            self._has_items.clear()
+            await self._has_items.wait()
+        song = self._queue.popleft()
+        if not self._queue:
+            self._has_items.clear()
+        return song
 
     def clear(self):
+        for song in self._queue:
+            song.release()
         self._queue.clear()
+        self._has_items.clear()
 
     def shuffle(self):
-        random.shuffle(self._queue)
+        # shuffling the deque in place would index into it O(n) times, each walking its blocks
+        songs = list(self._queue)
+        random.shuffle(songs)
+        self._queue.clear()
+        self._queue.extend(songs)
+        # only the head gets prefetched, so a song shuffled away from it would sit on ffmpeg
+        for song in itertools.islice(self._queue, 1, None):
+            song.release()
 
     def remove(self, index: int):
-        self._queue.pop(index)
+        self._queue[index].release()
+        del self._queue[index]
+        if not self._queue:
+            self._has_items.clear()
+
+
+class PrimedAudio(discord.AudioSource):
+    """Audio source that reads its first frame up front, so ffmpeg is already streaming when playback starts."""
+
+    def __init__(self, original: discord.AudioSource):
+        self.original = original
+        self._first = original.read()
+
+    def read(self):
+        if self._first is not None:
+            frame, self._first = self._first, None
+            return frame
+        return self.original.read()
 
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self.original.cleanup()
+
+
+class Song:
+
+    _inflight = {}
 
-class Song(discord.PCMVolumeTransformer):
     def __init__(
         self,
         ctx: commands.Context,
-        source: discord.FFmpegPCMAudio,
         *,
         data: dict,
-        volume: float = 0.5,
     ):
-        super().__init__(source, volume)
+        self.source = None
+        self._prepare_lock = asyncio.Lock()
+        # state -> the parts of the embed payload that never change
+        self._embed_cache = {}
 
         self.title = data.get("title")
         self.video = data.get("url")
+        self.codec = data.get("acodec")
         self.url = data.get("webpage_url")
         self.thumbnail = data.get("thumbnail")
-        self.duration = datetime.timedelta(seconds=data.get("duration"))
+        self.duration_seconds = int(data.get("duration") or 0)
+        # songs never change, so format these once instead of per embed / queue listing
+        self.duration_str = fmt_duration(self.duration_seconds)
+        self.queue_line = f"[{self.title}]({self.url}) `{self.duration_str}`"
 
         self.requester = ctx.author
         self.channel = ctx.channel
         self.data = data
 
     @classmethod
-    async def from_search(cls, ctx, search, *, loop=None, stream=True):
-        loop = loop or asyncio.get_event_loop()
-        entries = await loop.run_in_executor(
-            None, lambda: ytdl.extract_info(search, download=not stream)
+    async def from_search(cls, ctx, search):
+        data = extract_cache.get(search)
+        if data is None:
+            data = await cls._fetch_once(ctx, search)
+        return cls(ctx, data=data)
+
+    @classmethod
+    async def _fetch_once(cls, ctx, search):
+        """Fetch search, sharing the result with identical searches that arrive while it runs."""
+        key = extract_cache.key(search)
+        task = cls._inflight.get(key)
+        if task is None:
+            task = cls._inflight[key] = _create_task(cls._fetch(ctx, search))
+            task.add_done_callback(lambda _: cls._inflight.pop(key, None))
+        # shielded so a cancelled command doesn't cancel the fetch for everyone else
+        return await asyncio.shield(task)
+
+    async def prepare(self):
+        """Open the audio source, unless it was already prefetched."""
+        async with self._prepare_lock:
+            if self.source is None:
+                # priming blocks until ffmpeg has produced a frame, so keep it off the loop
+                self.source = await asyncio.to_thread(
+                    self._open_source, self.video, self.codec
+                )
+
+    def release(self):
+        """Close a prefetched source, which keeps an ffmpeg process and its stream open."""
+        if self.source is not None:
+            self.source.cleanup()
+            self.source = None
+
+    @staticmethod
+    def _open_source(video: str, codec: str):
+        # ffmpeg produces opus itself, so discord.py has nothing left to re-encode.
+        # for an opus stream, codec="opus" makes ffmpeg copy it instead of transcoding
+        return PrimedAudio(
+            discord.FFmpegOpusAudio(video, codec=codec, **FFMPEG_OPTIONS)
         )
 
-        if entries is None:
-            raise ValueError(f"Couldn't find anything that matches `{search}`")
-        data = entries.get("entries")
-        if data is None:
-            data = entries
+    @staticmethod
+    async def _fetch(ctx, search):
+        loop = asyncio.get_running_loop()
+        if YT_VIDEO_ID_RE.search(search):
+            # a single youtube video, so skip matching the url against every extractor
+            query, ie_key = clean_yt_watch_url(search), "Youtube"
         else:
-            for entry in entries["entries"]:
-                if entry:
-                    data = entry
-                    break
+            query, ie_key = search, None
+        pool = EXTRACT_POOL
+        try:
+            data = await loop.run_in_executor(pool, _extract, query, ie_key)
+        except concurrent.futures.process.BrokenProcessPool:
+            # a worker died (e.g. OOM-killed), which breaks the pool for good, so start a
+            # new one, unless a concurrent fetch already has
+            if EXTRACT_POOL is pool:
+                logger.warning("Extraction pool broke, restarting it")
+                pool.shutdown(wait=False)
+                _start_extract_pool()
+            data = await loop.run_in_executor(EXTRACT_POOL, _extract, query, ie_key)
+
+        if data is None:
+            raise ValueError(f"Couldn't find anything that matches `{search}`")
         if data["is_live"]:
             await ctx.reply(
                 "Youtube is giving me back live videos, which I can't currently deal with. Try a different search string or give me a url."
             )
             raise ValueError("Live stream")
-        return cls(
-            ctx, discord.FFmpegPCMAudio(data["url"], **FFMPEG_OPTIONS), data=data
-        )
+        return extract_cache.put(search, data)
 
-    def embed(self, *, state):
-        """Create an embed with state in {'playing', 'queued'}"""
+    def embed(self, *, state, footer):
+        """Create an embed with state in {'playing', 'queued'} and footer as set_footer kwargs"""
         if state not in ("playing", "queued"):
             raise ValueError("Embed must state must be in (playing, queued).")
 
-        return (
-            discord.Embed(
-                description=f"Now {state}: [{self.title}]({self.url})",
-                timestamp=datetime.datetime.utcnow(),
-                color=EMBED_COLOR,
-            )
-            .add_field(name="Duration:", value=self.duration_str)
-            .add_field(name="Requested by:", value=self.requester.mention)
-            .set_thumbnail(url=self.thumbnail)
-            .set_footer(text=bot.user.display_name, icon_url=bot.user.avatar_url)
+        payload = self._embed_cache.get(state)
+        if payload is None:
+            payload = self._embed_cache[state] = {
+                "description": f"Now {state}: [{self.title}]({self.url})",
+                "color": EMBED_COLOR,
+                "fields": [
+                    {"name": "Duration:", "value": self.duration_str, "inline": True},
+                    {
+                        "name": "Requested by:",
+                        "value": self.requester.mention,
+                        "inline": True,
+                    },
+                ],
+                "thumbnail": {"url": self.thumbnail},
+            }
+
+        # build the embed in one go rather than through the chain of setters.
+        # from_dict keeps the containers it's given, so copy the ones callers may add to
+        embed = discord.Embed.from_dict(
+            {**payload, "fields": list(payload["fields"]), "footer": dict(footer)}
         )
-
-    @property
-    def duration_str(self):
-        minutes, seconds = divmod(self.duration.seconds, 60)
-        hours, minutes = divmod(minutes, 60)
-
-        duration = []
-
-        if hours > 0:
-            duration.append(f"{hours}".rjust(2, "0"))
-
-        duration.append(f"{minutes}".rjust(2, "0"))
-        duration.append(f"{seconds}".rjust(2, "0"))
-
-        return ":".join(duration)
+        # set directly, as from_dict would parse an iso string back into a datetime
+        embed.timestamp = datetime.datetime.now(datetime.timezone.utc)
+        return embed
 
 
 class Player:
@@ -144,14 +413,20 @@ class Player:
 
     def __init__(self, ctx: commands.Context):
         self.bot = ctx.bot
+        self.cog = ctx.cog
         self.ctx = ctx
+        self._loop = ctx.bot.loop
+        self._loop_thread = threading.get_ident()
 
         self.current = None
         self.queue = SongQueue()
         self.next = asyncio.Event()
         self.voice = ctx.voice_client
+        self._pending_adds = {}  # channel id -> [(ctx, song)] waiting to be announced
+        self._idle_handle = None
 
-        self.task = self.bot.loop.create_task(self.play())
+        self.task = _create_task(self.play())
+        self.task.add_done_callback(self._on_task_done)
 
         self._players[ctx.guild.id] = self
 
@@ -159,24 +434,106 @@ class Player:
     def player(cls, ctx: commands.Context):
         return cls._players.get(ctx.guild.id) or cls(ctx)
 
+    @classmethod
+    def get(cls, ctx: commands.Context):
+        """Return the guild's player without creating one."""
+        return cls._players.get(ctx.guild.id)
+
     async def play(self):
         while True:
             self.next.clear()
+            # one timer per idle spell, rather than a wait_for timeout around every get
+            if len(self.queue) == 0:
+                self._idle_handle = self._loop.call_later(IDLE_TIMEOUT, self._on_idle)
+            try:
+                song = self.current = await self.queue.get()
+            finally:
+                # also on the way out, or the timer would disconnect whoever uses voice next
+                if self._idle_handle is not None:
+                    self._idle_handle.cancel()
+                    self._idle_handle = None
             try:
-                self.current = await asyncio.wait_for(self.queue.get(), timeout=300)
-            except asyncio.TimeoutError:
-                await self.voice.disconnect()
-                self.stop()
-                return
-            await self.current.channel.send(embed=self.current.embed(state="playing"))
-            self.voice.play(self.current, after=lambda e: self.next.set())
+                await song.prepare()
+                # skip() clears current, including while the song is still opening
+                if self.current is not song:
+                    song.release()
+                    continue
+                await song.channel.send(
+                    embed=song.embed(state="playing", footer=self.cog.footer)
+                )
+                if self.current is not song:
+                    song.release()
+                    continue
+                self.voice.play(song.source, after=self._after_playback)
+            except Exception:
+                # one song that won't open or start shouldn't take the player down with it
+                logger.exception("Couldn't play %s in %s", song.title, self.ctx.guild)
+                self.current = None
+                continue
+            _create_task(self._prefetch_next())
             await self.next.wait()
+            self.current = None
 
-    def stop(self):
+    def _on_task_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(
+                "Player in %s stopped", self.ctx.guild, exc_info=task.exception()
+            )
+        # a dead player would otherwise keep taking songs it never plays
+        if self._players.get(self.ctx.guild.id) is self:
+            del self._players[self.ctx.guild.id]
+
+    def _on_idle(self):
+        task = _create_task(self._leave_idle())
+        task.add_done_callback(_log_task_error)
+
+    async def _leave_idle(self):
+        # unregister first, so a !play during the disconnect starts a new player
+        await self.stop()
+        # unless that has already happened and the new player is using the connection
+        if Player.get(self.ctx) is None:
+            await self.voice.disconnect()
+
+    def _after_playback(self, error):
+        if error is not None:
+            logger.error("Playback in %s failed: %s", self.ctx.guild, error)
+        self._call_soon(self.next.set)
+
+    def _call_soon(self, callback):
+        """Schedule callback on the loop, only paying for the thread-safe wakeup when off the loop's thread."""
+        if threading.get_ident() == self._loop_thread:
+            self._loop.call_soon(callback)
+        else:
+            # e.g. the voice client's audio thread; asyncio.Event isn't thread-safe
+            self._loop.call_soon_threadsafe(callback)
+
+    async def _prefetch_next(self):
+        """Open the next song's source while the current one plays, so it starts without a gap."""
+        if len(self.queue) == 0:
+            return
+        song = self.queue[0]
+        try:
+            await song.prepare()
+        except Exception:
+            # tried again when the song comes up
+            logger.debug("Couldn't prefetch %s", song.title, exc_info=True)
+            return
+        # cleared, removed or shuffled away while it was opening
+        if song is not self.current and (not self.queue or self.queue[0] is not song):
+            song.release()
+
+    async def stop(self):
         self.queue.clear()
         if self.voice.is_playing():
             self.voice.stop()
-        self._players.pop(self.ctx.guild.id, None)
+        if self._players.get(self.ctx.guild.id) is self:
+            del self._players[self.ctx.guild.id]
+        # don't leave the loop or its idle timer running behind a stopped player
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
 
     def skip(self):
         self.current = None
@@ -184,17 +541,59 @@ class Player:
             self.voice.stop()
 
     async def add(self, song: Song, ctx: commands.Context):
-        await self.queue.put(song)
-        if ctx.voice_client is not None and ctx.voice_client.is_playing():
-            await ctx.reply(embed=song.embed(state="queued"))
+        self.queue.put(song)
+        if len(self.queue) == 1:
+            # next up, so start opening it now rather than when the current song ends
+            _create_task(self._prefetch_next())
+        # a song that starts straight away gets its "playing" embed, so only announce
+        # it as queued when something is playing or waiting ahead of it
+        if self.current is not None or len(self.queue) > 1:
+            self._announce_queued(song, ctx)
+
+    def _announce_queued(self, song: Song, ctx: commands.Context):
+        pending = self._pending_adds.setdefault(ctx.channel.id, [])
+        pending.append((ctx, song))
+        if len(pending) == 1:
+            task = _create_task(self._flush_queued(ctx.channel))
+            task.add_done_callback(_log_task_error)
+
+    async def _flush_queued(self, channel):
+        """Announce every song queued in channel during the last ANNOUNCE_DELAY seconds in one message."""
+        await asyncio.sleep(ANNOUNCE_DELAY)
+        pending = self._pending_adds.pop(channel.id)
+        if len(pending) == 1:
+            ctx, song = pending[0]
+            return await ctx.reply(
+                embed=song.embed(state="queued", footer=self.cog.footer)
+            )
 
-    def __del__(self):
-        self.task.cancel()
+        lines = "\n".join(song.queue_line for _, song in pending)
+        embed = discord.Embed(
+            description=f"Queued {len(pending)} songs:\n{lines}",
+            timestamp=datetime.datetime.now(datetime.timezone.utc),
+            color=EMBED_COLOR,
+        ).set_footer(**self.cog.footer)
+        await channel.send(embed=embed)
 
 
 class Music(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        self.footer = {}
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # avatar_url builds a new Asset on every access, so look it up once
+        self.footer = {
+            "text": self.bot.user.display_name,
+            "icon_url": str(self.bot.user.avatar_url),
+        }
+
+    @staticmethod
+    def _ack(ctx: commands.Context):
+        """React to the command, without holding it up on the REST round-trip."""
+        task = _create_task(ctx.message.add_reaction("✅"))
+        task.add_done_callback(_log_task_error)
 
     @commands.command()
     async def join(self, ctx: commands.Context):
@@ -203,114 +602,182 @@ class Music(commands.Cog):
             if ctx.voice_client is None:
                 await ctx.author.voice.channel.connect()
             elif ctx.voice_client.channel != ctx.author.voice.channel:
-                player = Player.player(ctx)
-                player.stop()
+                if player := Player.get(ctx):
+                    await player.stop()
                 await ctx.voice_client.move_to(ctx.author.voice.channel)
+            # the player's idle timeout is what disconnects us again
+            Player.player(ctx)
         else:
             await ctx.reply("You are not connected to a voice channel.")
             raise commands.CommandError("Author not connected to a voice channel.")
 
     @commands.command()
     async def play(self, ctx: commands.Context, *, search: str):
-        """Joins your voice channel and plays from a search string (almost anything youtube_dl supports)."""
+        """Joins your voice channel and plays from a search string (almost anything yt-dlp supports)."""
 
-        print(f'{ctx.author} requested a song with string "{search}".')
+        logger.debug('%s requested a song with string "%s".', ctx.author, search)
 
-        song = await Song.from_search(ctx, search, loop=self.bot.loop, stream=True)
+        # checked before extracting too, so a full queue doesn't cost a yt-dlp lookup
+        await self._check_queue_room(ctx)
+        song = await Song.from_search(ctx, search)
+        await self._check_queue_room(ctx)
         await ctx.invoke(self.join)
         player = Player.player(ctx)
         await player.add(song, ctx)
 
+    @staticmethod
+    async def _check_queue_room(ctx: commands.Context):
+        player = Player.get(ctx)
+        if player is not None and len(player.queue) >= MAX_QUEUE_SIZE:
+            await ctx.reply(f"The queue is full ({MAX_QUEUE_SIZE} songs).")
+            raise commands.CommandError("Queue is full.")
+
     @commands.command()
     async def stop(self, ctx: commands.Context):
         """Stops, clears the queue, and disconnects the bot from voice"""
-        print(f"{ctx.author} stopped.")
-        if player := Player.player(ctx):
-            player.stop()
-        await ctx.message.add_reaction("✅")
+        logger.debug("%s stopped.", ctx.author)
+        player = Player.get(ctx)
+        if player is None and ctx.voice_client is None:
+            return
+        if player:
+            await player.stop()
+        self._ack(ctx)
         if ctx.voice_client:
             await ctx.voice_client.disconnect()
 
     @commands.command()
     async def skip(self, ctx: commands.Context):
         """Skips the song at the front of the queue."""
-        print(f"{ctx.author} skipped.")
-        Player.player(ctx).skip()
-        await ctx.message.add_reaction("✅")
+        logger.debug("%s skipped.", ctx.author)
+        if player := Player.get(ctx):
+            player.skip()
+            self._ack(ctx)
 
     @commands.command()
     async def shuffle(self, ctx: commands.Context):
         """Shuffles the queue."""
-        player = Player.player(ctx)
-        player.queue.shuffle()
-        await ctx.message.add_reaction("✅")
+        if player := Player.get(ctx):
+            player.queue.shuffle()
+            self._ack(ctx)
 
     @commands.command()
     async def clear(self, ctx: commands.Context):
         """Clears the queue."""
-        player = Player.player(ctx)
-        player.queue.clear()
+        if player := Player.get(ctx):
+            player.queue.clear()
+            self._ack(ctx)
 
     @commands.command()
     async def remove(self, ctx: commands.Context, idx: int):
         """Removes the given number from the queue."""
-        player = Player.player(ctx)
+        player = Player.get(ctx)
+        queued = len(player.queue) if player else 0
+        if not 1 <= idx <= queued:
+            return await ctx.reply(f"There's no song #{idx} in the queue.")
         player.queue.remove(idx - 1)
-        await ctx.message.add_reaction("✅")
+        self._ack(ctx)
 
     @commands.command()
     async def queue(self, ctx: commands.Context, page: int = 1):
         """Shows the current queue."""
-        print(f"{ctx.author} requested the queue.")
+        logger.debug("%s requested the queue.", ctx.author)
 
-        player = Player.player(ctx)
+        player = Player.get(ctx)
         embed = discord.Embed(
             description=f"Current queue:",
-            timestamp=datetime.datetime.utcnow(),
+            timestamp=datetime.datetime.now(datetime.timezone.utc),
             color=EMBED_COLOR,
         )
         if not player:
             return await ctx.reply(embed=embed)
 
         if player.current:
-            embed = player.current.embed(state="playing")
+            embed = player.current.embed(state="playing", footer=self.footer)
 
         if len(player.queue) == 0:
             return await ctx.reply(embed=embed)
 
         items_per_page = 10
-        pages = math.ceil(player.queue.qsize() / items_per_page)
+        pages = math.ceil(len(player.queue) / items_per_page)
+        page = min(max(page, 1), pages)
 
         start = (page - 1) * items_per_page
         end = start + items_per_page
 
-        queue_str = ""
-        for i, song in enumerate(player.queue[start:end], start=1):
-            queue_str += f"#{i}: [{song.title}]({song.url}) `{song.duration}`\n"
-
-        embed.add_field(name="Up next:", value=queue_str, inline=False)
-        embed.set_footer(text=f"Page {page}/{pages}", icon_url=self.bot.user.avatar_url)
+        lines = []
+        length = 0
+        # long titles can overflow the field, so keep room to say how many were left out
+        budget = EMBED_FIELD_LIMIT - len(f"…and {items_per_page} more")
+        # number by queue position, which is what !remove takes
+        page_songs = itertools.islice(player.queue, start, end)
+        for i, song in enumerate(page_songs, start=start + 1):
+            line = f"#{i}: {song.queue_line}\n"
+            length += len(line)
+            if length > budget:
+                break
+            lines.append(line)
+        hidden = min(end, len(player.queue)) - start - len(lines)
+        if hidden:
+            lines.append(f"…and {hidden} more")
+
+        embed.add_field(name="Up next:", value="".join(lines), inline=False)
+        embed.set_footer(
+            text=f"Page {page}/{pages}",
+            icon_url=self.footer.get("icon_url", discord.Embed.Empty),
+        )
         await ctx.reply(embed=embed)
 
 
-bot = commands.Bot(command_prefix=commands.when_mentioned_or("!"))
-bot.add_cog(Music(bot))
-
-
-@bot.check
 async def message_check(ctx: commands.Context):
     return ctx.channel.name == "orpheus" and ctx.message.guild is not None
 
 
-@bot.event
 async def on_ready():
-    print(f"Logged in as {bot.user}")
+    logger.info("Logged in as %s", bot.user)
 
 
-@bot.event
 async def on_command_error(ctx: commands.Context, exception: Exception):
+    if isinstance(exception, commands.CommandInvokeError):
+        # raised inside the command; this handler replaces discord.py's traceback printer
+        logger.error(
+            "Command %r from %s failed",
+            ctx.message.content,
+            ctx.author,
+            exc_info=exception,
+        )
+    else:
+        logger.warning(
+            "Command %r from %s failed: %s", ctx.message.content, ctx.author, exception
+        )
     await ctx.author.send(f"I ran into an exception!\n```{exception}```")
 
 
 if __name__ == "__main__":
-    bot.run(ORPHEUS_DISCORD_TOKEN)
+    # handlers only enqueue records, the listener thread formats and writes them
+    log_queue = queue.SimpleQueue()
+    logging.basicConfig(
+        level=ORPHEUS_LOG_LEVEL, handlers=[DeferredQueueHandler(log_queue)]
+    )
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+
+    _start_extract_pool()
+    atexit.register(_stop_extract_pool)
+
+    # the bot grabs its event loop on construction, so the policy goes first
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    bot = commands.Bot(command_prefix=commands.when_mentioned_or("!"))
+    bot.add_cog(Music(bot))
+    bot.add_check(message_check)
+    bot.event(on_ready)
+    bot.event(on_command_error)
+    try:
+        bot.run(ORPHEUS_DISCORD_TOKEN)
+    finally:
+        listener.stop()